@@ -3,10 +3,11 @@
 # ------------------------------------------------------------------------------
 # Follow changes (commits) in CVEProject / cvelistV5
 #
-# Usage: follow-cvelist.py [-haForu4] [-vvvv] [-i s] [-c N] [-w N] [-m f]
+# Usage: follow-cvelist.py [-haCForu4] [-vvvv] [-i s] [-c N] [-w N] [-m f]
 #
 #  -h, --help          show this help message and exit
 #  -a, --ansi          add ansi colors to the output (default: False)
+#  -C, --coalesce      initial commits as one net change per CVE (default: False)
 #  -F, --force         origin/main hard reset if git pull fails (default: False)
 #  -o, --once          only the current tail; no active follow (default: False)
 #  -r, --reload-only   skip pulls & only follow local changes (default: False)
@@ -124,7 +125,7 @@ class CvelistFollower:
         print(f"{''.ljust(self.width(), '-')}", file=sys.stderr)
 
     def history(self) -> None:
-        """Prints CVE changes from the commit history, one commit at a time"""
+        """Prints CVE changes from the commit history, one commit at a time or net"""
         history = self.args.commits
         try:
             cursor = self.get_cursor(history)
@@ -135,6 +136,13 @@ class CvelistFollower:
             )
             history = 1
             cursor = self.get_cursor(history)
+        if self.args.coalesce:
+            # One diff over the whole range; each CVE only at both endpoints.
+            new_cursor = self.get_cursor()
+            if self.args.verbose > 0:
+                print(f"[{cursor} → {new_cursor}]", file=sys.stderr)
+            self.print_changes(new_cursor, cursor)
+            return
         while history > 0:
             history -= 1
             new_cursor = self.get_cursor(history)
@@ -655,7 +663,7 @@ def check_positive(value: str) -> int:
 if __name__ == "__main__":
     argParser = argparse.ArgumentParser(
         description="Follow changes (commits) in CVEProject / cvelistV5",
-        usage="%(prog)s [-haForu4] [-vvvv] [-i s] [-c N] [-w N] [-m f]",
+        usage="%(prog)s [-haCForu4] [-vvvv] [-i s] [-c N] [-w N] [-m f]",
         epilog="Requires git. "
         "Working directory must be the root of the cvelistV5 repository.",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -667,6 +675,13 @@ if __name__ == "__main__":
         help="add ansi colors to the output",
         default=False,
     )
+    argParser.add_argument(
+        "-C",
+        "--coalesce",
+        action="store_true",
+        help="initial commits as one net change per CVE",
+        default=False,
+    )
     argParser.add_argument(
         "-F",
         "--force",
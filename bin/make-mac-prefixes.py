@@ -8,20 +8,93 @@
 # Usage: cat oui.csv | ./make-mac-prefixes.py > nmap-mac-prefixes
 # Tip: curl https://standards-oui.ieee.org/oui/oui.csv | ./make-mac-prefixes.py
 #
+# All the IEEE registries can be merged by giving the CSV files as arguments:
+# ./make-mac-prefixes.py oui.csv mam.csv oui36.csv iab.csv cid.csv > nmap-mac-prefixes
+# The more specific MA-M (28-bit) & MA-S/IAB (36-bit) prefixes win on lookups.
+# Rows sharing a prefix are all output, as in oui.csv; lookups use the first.
+#
+#  -h, --help               show this help message and exit
+#  -b, --benchmark          benchmark vendor name normalization on oui.csv
+#  -o FILE, --output FILE   write (atomically) to the FILE instead of stdout
+#  -i, --incremental        only process changed assignments; requires --output
+#  -s FILE, --state FILE    row hashes for --incremental (default: FILE.state)
+#  -x FILE, --index FILE    write a JSON longest-prefix-match index to the FILE
+#  -d FILE, --database FILE write a binary (mmap & binary search) database FILE
+#
+# The binary database (little-endian) consists of a header: magic "MACPFXDB",
+# uint16 version & uint16 number of sections; per section (longest prefixes
+# first) uint32 prefix bits, count, keys offset & values offset; then uint32
+# string table offset & size. Keys are sorted uint32 (<= 32 bits) or uint64
+# integer prefixes, values uint32 offsets to deduplicated vendor strings in the
+# string table (uint16 length + UTF-8). See PrefixDatabase for a reader.
+#
+# Lookup mode annotates MAC addresses (colon, dash, dot or bare notation) in
+# lines from stdin with their vendors (tab separated) using a generated
+# nmap-mac-prefixes, JSON index or binary database:
+# ./make-mac-prefixes.py -l prefixes.db [-c N | -r REGEX] < dhcp.log > annotated.log
+#
+#  -l FILE, --lookup FILE   annotate MACs from stdin using the prefix data FILE
+#  -c N, --column N         MAC in whitespace separated column N (default: any)
+#  -r RE, --regex RE        MAC in the first group (or match) of the regex RE
+#  -n N, --batch N          lines processed per batch (default: 10000)
+#
+# Incremental mode: ./make-mac-prefixes.py -i -o nmap-mac-prefixes < oui.csv
+# Changes in the registry are reported to stderr (+ added, ~ changed, - removed).
+# Edits to SHORTEN_RULES, ADDITIONS, SORT, HEADER or MERGED_NOTE force a full
+# regeneration.
+#
 # Author : Esa Jokinen (oh2fih)
 # Home   : https://github.com/oh2fih/Misc-Scripts
 # ------------------------------------------------------------------------------
 # flake8: noqa: E501
 
+import argparse
+import bisect
 import csv
+import functools
+import hashlib
+import itertools
+import json
+import mmap
 import os
 import re
+import shutil
+import struct
 import sys
-from typing import List, TextIO
+import tempfile
+import time
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Pattern,
+    TextIO,
+    Tuple,
+    Union,
+)
 
 # Sort the list by MAC prefix: True = sort, False = preserve original order.
 SORT = False
 
+# Rules to shorten the organization names, applied in order after decapitalizing:
+# (regular expression, replacement, flags), e.g., eliminating Inc. & trailing junk.
+SHORTEN_RULES = [
+    (r",.{1,6}$", "", 0),
+    (
+        r" (Corporation|Inc|Ltd|Corp|S\.A|Co|llc|pty|l\.l\.c|s\.p\.a|b\.v)(\.|\b)",
+        "",
+        re.IGNORECASE,
+    ),
+    (r"\s+.$", "", 0),
+]
+
+# Maximum number of normalized organization names memoized (None = unbounded).
+# Many organizations own hundreds of OUIs with identical names.
+CACHE_SIZE = 32768
+
 HEADER = """\
 # MAC prefix list generated with make-mac-prefixes.py by Esa Jokinen (oh2fih).
 # Original data comes from IEEE's https://standards-oui.ieee.org/oui/oui.csv
@@ -30,6 +103,32 @@ HEADER = """\
 # See https://standards.ieee.org/products-programs/regauth/\
 """
 
+# Added to the HEADER when other registries than MA-L were read.
+MERGED_NOTE = """# Assignments from MA-M (28-bit), MA-S & IAB (36-bit) & CID registries are
+# included; the longest (most specific) matching prefix applies.\
+"""
+
+# Binary database format; see PrefixIndex.pack() & PrefixDatabase.
+DB_MAGIC = b"MACPFXDB"
+DB_VERSION = 1
+DB_HEADER = struct.Struct("<8sHH")
+DB_SECTION = struct.Struct("<IIII")
+DB_STRINGS = struct.Struct("<II")
+
+# MAC address in colon, dash, dot (Cisco) or bare notation for the lookup mode.
+# A common leading octet & word boundaries keep the search fast on long lines.
+MAC = re.compile(
+    rb"\b[0-9A-Fa-f]{2}(?:"
+    rb"(?:[:-][0-9A-Fa-f]{2}){5}|"
+    rb"[0-9A-Fa-f]{2}(?:\.[0-9A-Fa-f]{4}){2}|"
+    rb"[0-9A-Fa-f]{10}"
+    rb")\b"
+)
+
+# First line of the incremental mode state file, followed by the settings
+# fingerprint & the output checksum.
+STATE_HEADER = "# make-mac-prefixes.py state v4"
+
 ADDITIONS = [
     "525400 QEMU virtual NIC",
     "B0C420 Bochs virtual NIC",
@@ -39,26 +138,66 @@ ADDITIONS = [
 ]
 
 
-def main(csvdata: TextIO) -> List[str]:
-    """Return processed (and optionally sorted) OUIs with ADDITIONS"""
-    OUIs = []
+def main(csvdata: List[TextIO]) -> Tuple[str, List[str]]:
+    """Return the header & processed (and optionally sorted) OUIs with ADDITIONS"""
+    assignments, registries = readAssignments(csvdata)
+    OUIs = [f"{prefix} {NORMALIZER.normalize(name)}" for prefix, name, _ in assignments]
+    return outputHeader(registries), withAdditions(OUIs)
 
-    CSVReader = csv.reader(
-        csvdata.readlines(), dialect="excel", delimiter=",", quotechar='"'
-    )
-    next(CSVReader, None)  # skip the headers
-    for Row in CSVReader:
-        if validatePrefix(Row[1]):
-            OUIs.append(f"{Row[1]} {shorten(decapitalize(Row[2]))}")
-        else:
-            print(f"# Invalid prefix '{Row[1]}' in {Row}", file=sys.stderr)
 
-    if not OUIs:
+def readAssignments(
+    csvdata: List[TextIO],
+) -> Tuple[List[Tuple[str, str, str]], Dict[str, int]]:
+    """Return valid (prefix, organization name, row hash) assignments in order
+    & the number of assignments per registry"""
+    assignments = []
+    registries: Dict[str, int] = {}
+    seen = set()
+    duplicates = 0
+
+    for csvfile in csvdata:
+        CSVReader = csv.reader(
+            csvfile.readlines(), dialect="excel", delimiter=",", quotechar='"'
+        )
+        next(CSVReader, None)  # skip the headers
+        for Row in CSVReader:
+            if not validatePrefix(Row[1]):
+                print(f"# Invalid prefix '{Row[1]}' in {Row}", file=sys.stderr)
+                continue
+            if Row[1].upper() in seen:
+                duplicates += 1
+            seen.add(Row[1].upper())
+            assignments.append((Row[1], Row[2], rowHash(Row)))
+            registries[Row[0]] = registries.get(Row[0], 0) + 1
+
+    if not assignments:
         print("# Incorrect input format; oui.csv expected.", file=sys.stderr)
         exit(1)
+    elif list(registries) == ["MA-L"]:
+        print(f"# Found {len(assignments)} registed OUIs.", file=sys.stderr)
     else:
-        print(f"# Found {len(OUIs)} registed OUIs.", file=sys.stderr)
+        found = ", ".join(f"{count} {name}" for name, count in registries.items())
+        print(
+            f"# Found {len(assignments)} registed prefixes: {found}.", file=sys.stderr
+        )
+    if duplicates:
+        print(
+            f"# {duplicates} rows repeat an earlier prefix; all are kept, "
+            f"the first one applies to lookups.",
+            file=sys.stderr,
+        )
+    return assignments, registries
 
+
+def outputHeader(registries: Dict[str, int]) -> str:
+    """The HEADER, with the MERGED_NOTE if other registries than MA-L were read"""
+    if set(registries) - {"MA-L"}:
+        return f"{HEADER}\n{MERGED_NOTE}"
+    return HEADER
+
+
+def withAdditions(OUIs: List[str]) -> List[str]:
+    """Append ADDITIONS to the processed OUIs & sort if configured"""
     for addition in ADDITIONS:
         OUIs.append(addition)
     print(f"# Added {len(ADDITIONS)} unregisted OUIs.", file=sys.stderr)
@@ -69,8 +208,523 @@ def main(csvdata: TextIO) -> List[str]:
     return OUIs
 
 
+def rowHash(Row: List[str]) -> str:
+    """Short content hash of a CSV row for detecting changed assignments"""
+    return hashlib.blake2b("\x1f".join(Row).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def incremental(csvdata: List[TextIO], output: str, statefile: str) -> None:
+    """Regenerate only new & changed assignments; patch the output atomically"""
+    assignments, registries = readAssignments(csvdata)
+    state = loadState(statefile, output)
+
+    # Rows sharing a prefix are told apart by their occurrence number.
+    rows: List[Tuple[Tuple[str, int], str, str]] = []
+    occurrences: Dict[str, int] = {}
+    added, changed, removed = [], [], []
+    for prefix, name, rowhash in assignments:
+        key = (prefix, occurrences.get(prefix, 0))
+        occurrences[prefix] = key[1] + 1
+        past = state.get(key)
+        if past and past[0] == rowhash:
+            vendor = past[1] if past[1] is not None else NORMALIZER.normalize(name)
+            rows.append((key, rowhash, vendor))
+            continue
+        vendor = NORMALIZER.normalize(name)
+        rows.append((key, rowhash, vendor))
+        if past:
+            changed.append(f"# ~ {prefix} {past[1] or '?'} → {vendor}")
+        else:
+            added.append(f"# + {prefix} {vendor}")
+    current = set(key for key, _, _ in rows)
+    for key, past in state.items():
+        if key not in current:
+            removed.append(f"# - {key[0]} {past[1] or '?'}")
+    OUIs = [f"{prefix} {vendor}" for (prefix, _), _, vendor in rows]
+
+    if not state:
+        print(f"# No usable state in {statefile}; full regeneration.", file=sys.stderr)
+    else:
+        for line in added + changed + removed:
+            print(line, file=sys.stderr)
+        print(
+            f"# Added {len(added)}, changed {len(changed)} & removed {len(removed)} "
+            f"assignments; reused {len(OUIs) - len(added) - len(changed)}.",
+            file=sys.stderr,
+        )
+        if not added and not changed and not removed:
+            print(f"# {output} is up to date.", file=sys.stderr)
+            return
+
+    content = render(outputHeader(registries), withAdditions(OUIs))
+    writeAtomically(output, content)
+    writeAtomically(
+        statefile,
+        f"{STATE_HEADER} {fingerprint()} "
+        f"{hashlib.sha256(content.encode('utf-8')).hexdigest()}\n"
+        + "".join(
+            f"{prefix} {occurrence} {rowhash}\n"
+            for (prefix, occurrence), rowhash, _ in rows
+        ),
+    )
+    print(f"# Wrote {output} & {statefile}.", file=sys.stderr)
+
+
+def loadState(
+    statefile: str, output: str
+) -> Dict[Tuple[str, int], Tuple[str, Optional[str]]]:
+    """Row hashes by (prefix, occurrence) & their vendors recovered from the
+    output; empty if missing or stale"""
+    try:
+        with open(statefile, "r", encoding="utf-8") as file:
+            lines = file.read().splitlines()
+        with open(output, "rb") as file:
+            content = file.read()
+    except (FileNotFoundError, PermissionError):
+        return {}
+    checksum = hashlib.sha256(content).hexdigest()
+    if not lines or lines[0] != f"{STATE_HEADER} {fingerprint()} {checksum}":
+        return {}
+    keys = []
+    for line in lines[1:]:
+        fields = line.split(" ")
+        if len(fields) == 3:
+            keys.append(((fields[0], int(fields[1])), fields[2]))
+    # The checksum verified the output; its rows follow the header comments.
+    body = [
+        line
+        for line in content.decode("utf-8").splitlines()
+        if not line.startswith("#")
+    ]
+    if len(body) != len(keys) + len(ADDITIONS):
+        return {}
+    if not SORT:
+        # Assignments in the row order of the state, followed by the ADDITIONS.
+        state: Dict[Tuple[str, int], Tuple[str, Optional[str]]] = {}
+        for (key, rowhash), line in zip(keys, body):
+            prefix, _, vendor = line.partition(" ")
+            if prefix != key[0]:
+                return {}
+            state[key] = (rowhash, vendor)
+        return state
+    # Sorted output: a vendor is only known for a prefix on a single row.
+    additions = list(ADDITIONS)
+    vendors: Dict[str, List[str]] = {}
+    for line in body:
+        if line in additions:
+            additions.remove(line)
+            continue
+        prefix, _, vendor = line.partition(" ")
+        vendors.setdefault(prefix, []).append(vendor)
+    return {
+        key: (
+            rowhash,
+            vendors[key[0]][0] if len(vendors.get(key[0], [])) == 1 else None,
+        )
+        for key, rowhash in keys
+    }
+
+
+def fingerprint() -> str:
+    """Hash of the settings that shape the output; see loadState()"""
+    settings = json.dumps(
+        [
+            [
+                [pattern, replacement, int(flags)]
+                for pattern, replacement, flags in SHORTEN_RULES
+            ],
+            ADDITIONS,
+            SORT,
+            HEADER,
+            MERGED_NOTE,
+        ]
+    )
+    return hashlib.sha256(settings.encode("utf-8")).hexdigest()[:16]
+
+
+def render(header: str, OUIs: List[str]) -> str:
+    """The nmap-mac-prefixes file contents as printed to stdout"""
+    return f"{header}\n" + "\n".join(OUIs) + "\n"
+
+
+def writeAtomically(path: str, content: Union[str, bytes]) -> None:
+    """Replace the file with a fully written temporary file in the same directory"""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, temporary)
+        else:
+            os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+class VendorNormalizer:
+    """Normalizes organization names with precompiled rules & a bounded memo cache"""
+
+    def __init__(
+        self,
+        rules: List[Tuple[str, str, int]] = SHORTEN_RULES,
+        cachesize: Optional[int] = CACHE_SIZE,
+    ):
+        self.rules: List[Tuple[Pattern[str], str]] = [
+            (re.compile(pattern, flags), replacement)
+            for pattern, replacement, flags in rules
+        ]
+        # Memoized per instance & keyed by the raw organization name.
+        self.normalize = functools.lru_cache(maxsize=cachesize)(self.uncached)
+
+    def uncached(self, name: str) -> str:
+        """Decapitalize & shorten an organization name without the memo cache"""
+        return self.shorten(decapitalize(name))
+
+    def shorten(self, string: str) -> str:
+        """Apply the shortening rules in order"""
+        for pattern, replacement in self.rules:
+            string = pattern.sub(replacement, string)
+        return string
+
+
 def decapitalize(string: str) -> str:
     """Un-capitalize an all-caps company name"""
+    return " ".join(
+        word.lower().capitalize() if len(word) > 4 and allcaps(word) else word
+        for word in string.split()
+    )
+
+
+def allcaps(word: str) -> bool:
+    """Single pass: as many uppercase as alphabetic characters in the word"""
+    caps = alpha = 0
+    for char in word:
+        caps += char.isupper()
+        alpha += char.isalpha()
+    return caps == alpha
+
+
+def shorten(string: str) -> str:
+    """Rules to shorten the names a bit, such as eliminating Inc."""
+    return NORMALIZER.shorten(string)
+
+
+PREFIX = re.compile(r"^([0-9a-fA-F]{6}|[0-9a-fA-F]{7}|[0-9a-fA-F]{9})$")
+
+
+def validatePrefix(prefix: str) -> bool:
+    """Validates a MAC prefix: 6 (MA-L, CID), 7 (MA-M) or 9 (MA-S, IAB) hex digits"""
+    if PREFIX.match(prefix):
+        return True
+    else:
+        return False
+
+
+class PrefixIndex:
+    """Longest-prefix-match index of vendors keyed by prefix length & integer prefix"""
+
+    def __init__(self) -> None:
+        self.tables: Dict[int, Dict[int, str]] = {}
+        self.lengths: List[int] = []
+
+    def add(self, prefix: str, vendor: str) -> None:
+        """Add a hexadecimal prefix; the first vendor of a prefix is kept"""
+        bits = len(prefix) * 4
+        if bits not in self.tables:
+            self.tables[bits] = {}
+            self.lengths = sorted(self.tables, reverse=True)
+        self.tables[bits].setdefault(int(prefix, 16), vendor)
+
+    def lookup(self, mac: int) -> Optional[str]:
+        """Vendor of the most specific prefix matching a 48-bit MAC address"""
+        for bits in self.lengths:
+            vendor = self.tables[bits].get(mac >> (48 - bits))
+            if vendor is not None:
+                return vendor
+        return None
+
+    def __len__(self) -> int:
+        return sum(len(table) for table in self.tables.values())
+
+    @classmethod
+    def fromLines(cls, OUIs: List[str]) -> "PrefixIndex":
+        """Build the index from nmap-mac-prefixes lines as returned by main()"""
+        index = cls()
+        for line in OUIs:
+            if line and not line.startswith("#") and " " in line:
+                prefix, vendor = line.split(" ", 1)
+                index.add(prefix, vendor)
+        return index
+
+    @classmethod
+    def fromFile(cls, path: str) -> "PrefixIndex":
+        """Load a binary database, JSON index or nmap-mac-prefixes file"""
+        with open(path, "rb") as file:
+            magic = file.read(len(DB_MAGIC))
+        if magic == DB_MAGIC:
+            database = PrefixDatabase(path)
+            index = cls()
+            for bits, prefix, vendor in database.items():
+                index.tables.setdefault(bits, {})[prefix] = vendor
+            index.lengths = sorted(index.tables, reverse=True)
+            database.close()
+            return index
+        elif magic.startswith(b"{"):
+            return cls.load(path)
+        else:
+            with open(path, "r", encoding="utf-8") as file:
+                return cls.fromLines(file.read().splitlines())
+
+    @classmethod
+    def load(cls, path: str) -> "PrefixIndex":
+        """Load an index written by dump()"""
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        index = cls()
+        for bits, table in data["prefixes"].items():
+            index.tables[int(bits)] = {int(p, 16): v for p, v in table.items()}
+        index.lengths = sorted(index.tables, reverse=True)
+        return index
+
+    def dump(self) -> str:
+        """JSON with hex prefixes grouped by length, longest lengths first"""
+        return json.dumps(
+            {
+                "lengths": self.lengths,
+                "prefixes": {
+                    str(bits): {
+                        f"{prefix:0{bits // 4}X}": vendor
+                        for prefix, vendor in sorted(self.tables[bits].items())
+                    }
+                    for bits in self.lengths
+                },
+            },
+            ensure_ascii=False,
+            indent=0,
+        )
+
+    def pack(self) -> bytes:
+        """Binary database with sorted integer prefixes & a deduplicated string table"""
+        strings = bytearray()
+        offsets: Dict[str, int] = {}
+        sections = []
+        for bits in self.lengths:
+            keys, values = [], []
+            for prefix, vendor in sorted(self.tables[bits].items()):
+                if vendor not in offsets:
+                    encoded = vendor.encode("utf-8")[:0xFFFF]
+                    offsets[vendor] = len(strings)
+                    strings += struct.pack("<H", len(encoded)) + encoded
+                keys.append(prefix)
+                values.append(offsets[vendor])
+            keyformat = "I" if bits <= 32 else "Q"
+            sections.append(
+                (
+                    bits,
+                    struct.pack(f"<{len(keys)}{keyformat}", *keys),
+                    struct.pack(f"<{len(values)}I", *values),
+                )
+            )
+
+        # Header, then 8-byte aligned arrays per section & the string table.
+        offset = DB_HEADER.size + DB_SECTION.size * len(sections) + DB_STRINGS.size
+        header = DB_HEADER.pack(DB_MAGIC, DB_VERSION, len(sections))
+        body = bytearray()
+        for bits, packedkeys, packedvalues in sections:
+            body += bytes(-(offset + len(body)) % 8)
+            keysoffset = offset + len(body)
+            body += packedkeys
+            body += bytes(-(offset + len(body)) % 8)
+            header += DB_SECTION.pack(
+                bits, len(packedvalues) // 4, keysoffset, offset + len(body)
+            )
+            body += packedvalues
+        header += DB_STRINGS.pack(offset + len(body), len(strings))
+        return bytes(header + body + strings)
+
+
+class SortedKeys:
+    """Read-only sequence of packed integers for bisect; nothing is parsed upfront"""
+
+    def __init__(self, buffer: mmap.mmap, offset: int, count: int, bits: int):
+        self.buffer = buffer
+        self.offset = offset
+        self.count = count
+        self.format = struct.Struct("<I" if bits <= 32 else "<Q")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> int:
+        value: int = self.format.unpack_from(
+            self.buffer, self.offset + i * self.format.size
+        )[0]
+        return value
+
+
+class PrefixDatabase:
+    """Memory-mapped reader for the binary database written by PrefixIndex.pack()"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = DB_HEADER.unpack_from(self.buffer, 0)
+        if magic != DB_MAGIC or version != DB_VERSION:
+            raise ValueError(f"{path} is not a version {DB_VERSION} prefix database")
+        self.sections = []
+        for i in range(count):
+            bits, entries, keys, values = DB_SECTION.unpack_from(
+                self.buffer, DB_HEADER.size + i * DB_SECTION.size
+            )
+            self.sections.append(
+                (bits, SortedKeys(self.buffer, keys, entries, bits), values)
+            )
+        self.strings, _ = DB_STRINGS.unpack_from(
+            self.buffer, DB_HEADER.size + count * DB_SECTION.size
+        )
+
+    def vendor(self, offset: int) -> str:
+        """Vendor string at the offset of the string table"""
+        start = self.strings + offset
+        (length,) = struct.unpack_from("<H", self.buffer, start)
+        return self.buffer[start + 2 : start + 2 + length].decode("utf-8")
+
+    def lookup(self, mac: int) -> Optional[str]:
+        """Vendor of the most specific prefix matching a 48-bit MAC address"""
+        for bits, keys, values in self.sections:
+            prefix = mac >> (48 - bits)
+            i = bisect.bisect_left(keys, prefix)
+            if i < len(keys) and keys[i] == prefix:
+                (offset,) = struct.unpack_from("<I", self.buffer, values + i * 4)
+                return self.vendor(offset)
+        return None
+
+    def items(self) -> Iterator[Tuple[int, int, str]]:
+        """All (prefix bits, integer prefix, vendor) entries"""
+        for bits, keys, values in self.sections:
+            for i in range(len(keys)):
+                (offset,) = struct.unpack_from("<I", self.buffer, values + i * 4)
+                yield bits, keys[i], self.vendor(offset)
+
+    def close(self) -> None:
+        self.buffer.close()
+
+
+def annotate(
+    index: PrefixIndex,
+    instream: BinaryIO,
+    outstream: BinaryIO,
+    column: Optional[int] = None,
+    pattern: Pattern[bytes] = MAC,
+    batchsize: int = 10000,
+) -> int:
+    """Append the vendor of the MAC on each line (tab separated); return line count"""
+    tables = [
+        (48 - bits, {p: v.encode("utf-8") for p, v in index.tables[bits].items()})
+        for bits in index.lengths
+    ]
+    group = 1 if pattern.groups else 0
+    unknown = b"Unknown"
+    # Vendors memoized by the MAC as written; logs repeat the same MACs a lot.
+    cache: Dict[bytes, bytes] = {}
+    cached = cache.get
+    search = pattern.search
+    lines = 0
+
+    while True:
+        batch = list(itertools.islice(instream, batchsize))
+        if not batch:
+            break
+        lines += len(batch)
+        if len(cache) > 1000000:
+            cache.clear()
+        annotated: List[bytes] = []
+        append = annotated.append
+        for line in batch:
+            line = line.rstrip(b"\r\n")
+            if column is None:
+                match = search(line)
+                token = match.group(group) if match else b""
+            else:
+                fields = line.split(None, column)
+                token = fields[column - 1] if len(fields) >= column else b""
+            vendor = cached(token)
+            if vendor is None:
+                vendor = unknown
+                digits = token.translate(None, b":-.")
+                if len(digits) == 12:
+                    try:
+                        mac = int(digits, 16)
+                    except ValueError:
+                        mac = -1
+                    if mac >= 0:
+                        for shift, table in tables:
+                            found = table.get(mac >> shift)
+                            if found is not None:
+                                vendor = found
+                                break
+                cache[token] = vendor
+            append(b"%s\t%s\n" % (line, vendor))
+        outstream.write(b"".join(annotated))
+    outstream.flush()
+    return lines
+
+
+def benchmark(csvdata: List[TextIO]) -> None:
+    """Measure vendor name normalization throughput over all oui.csv rows"""
+    names: List[str] = []
+    for csvfile in csvdata:
+        CSVReader = csv.reader(
+            csvfile.readlines(), dialect="excel", delimiter=",", quotechar='"'
+        )
+        next(CSVReader, None)  # skip the headers
+        names.extend(Row[2] for Row in CSVReader if len(Row) > 2)
+    if not names:
+        print("# Incorrect input format; oui.csv expected.", file=sys.stderr)
+        exit(1)
+    print(
+        f"# {len(names)} rows, {len(set(names))} distinct organization names",
+        file=sys.stderr,
+    )
+
+    normalizer = VendorNormalizer()
+    runs: List[Tuple[str, Callable[[str], str]]] = [
+        ("reference", referenceNormalize),
+        ("precompiled", normalizer.uncached),
+        ("memoized (cold)", normalizer.normalize),
+        ("memoized (hits)", normalizer.normalize),
+    ]
+    baseline = 0.0
+    for title, function in runs:
+        begin = time.perf_counter()
+        for name in names:
+            function(name)
+        elapsed = time.perf_counter() - begin
+        baseline = baseline or elapsed
+        print(
+            f"# {title:<16} {elapsed * 1000:9.1f} ms "
+            f"{len(names) / elapsed:12.0f} rows/s {baseline / elapsed:6.2f}x",
+            file=sys.stderr,
+        )
+    print(f"# {normalizer.normalize.cache_info()}", file=sys.stderr)
+
+    mismatches = [n for n in names if normalizer.normalize(n) != referenceNormalize(n)]
+    if mismatches:
+        print(
+            f"# {len(mismatches)} results differ from the reference!", file=sys.stderr
+        )
+        exit(1)
+
+
+def referenceNormalize(string: str) -> str:
+    """The original decapitalize() & shorten(); the baseline of the benchmark"""
     decapitalized = ""
     words = string.split()
 
@@ -85,12 +739,7 @@ def decapitalize(string: str) -> str:
         else:
             decapitalized = f"{word}"
 
-    return decapitalized
-
-
-def shorten(string: str) -> str:
-    """Rules to shorten the names a bit, such as eliminating Inc."""
-    string = re.sub(r",.{1,6}$", "", string)
+    string = re.sub(r",.{1,6}$", "", decapitalized)
     string = re.sub(
         r" (Corporation|Inc|Ltd|Corp|S\.A|Co|llc|pty|l\.l\.c|s\.p\.a|b\.v)(\.|\b)",
         "",
@@ -101,18 +750,155 @@ def shorten(string: str) -> str:
     return string
 
 
-def validatePrefix(prefix: str) -> bool:
-    """Validates a MAC prefix: must consist of six hexadecimal characters"""
-    if re.match(r"^([0-9a-fA-F]{6})$", prefix):
-        return True
-    else:
-        return False
+def check_positive(value: str) -> int:
+    ivalue = int(value)
+    if ivalue <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return ivalue
+
+
+NORMALIZER = VendorNormalizer()
 
 
 if __name__ == "__main__":
     """Reads oui.csv from stdin & print nmap-mac-prefixes to stdout"""
-    if os.isatty(sys.stdin.fileno()):
-        print("# Please provide oui.csv from a pipe.", file=sys.stderr)
-        exit(1)
-    print(f"{HEADER}")
-    print("\n".join(main(sys.stdin)))
+    argParser = argparse.ArgumentParser(
+        description="Processes IEEE MA-L Assignments (oui.csv) from stdin "
+        "or IEEE registry CSV files to Nmap's nmap-mac-prefixes (stdout).",
+        usage="%(prog)s [-hbi] [-o FILE] [-s FILE] [-x FILE] [-d FILE] [csv ...] "
+        "> nmap-mac-prefixes\n"
+        "       %(prog)s -l FILE [-c N | -r RE] [-n N] < log > annotated",
+    )
+    argParser.add_argument(
+        "csv",
+        nargs="*",
+        type=argparse.FileType("r", encoding="utf-8"),
+        help="IEEE registry CSVs: oui.csv, mam.csv, oui36.csv, iab.csv, cid.csv "
+        "(default: stdin)",
+    )
+    argParser.add_argument(
+        "-b",
+        "--benchmark",
+        action="store_true",
+        help="benchmark vendor name normalization on oui.csv from stdin",
+        default=False,
+    )
+    argParser.add_argument(
+        "-o",
+        "--output",
+        metavar="FILE",
+        help="write (atomically) to the FILE instead of stdout",
+    )
+    argParser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="only process changed assignments; requires --output",
+        default=False,
+    )
+    argParser.add_argument(
+        "-s",
+        "--state",
+        metavar="FILE",
+        help="row hashes for --incremental (default: output FILE.state)",
+    )
+    argParser.add_argument(
+        "-x",
+        "--index",
+        metavar="FILE",
+        help="write a JSON longest-prefix-match index to the FILE",
+    )
+    argParser.add_argument(
+        "-d",
+        "--database",
+        metavar="FILE",
+        help="write a binary (mmap & binary search) database FILE",
+    )
+    lookup_group = argParser.add_argument_group("lookup mode")
+    lookup_group.add_argument(
+        "-l",
+        "--lookup",
+        metavar="FILE",
+        help="annotate MACs from stdin using the prefix data FILE "
+        "(nmap-mac-prefixes, JSON index or binary database)",
+    )
+    lookup_group.add_argument(
+        "-c",
+        "--column",
+        type=check_positive,
+        metavar="N",
+        help="MAC in whitespace separated column N (default: anywhere on the line)",
+    )
+    lookup_group.add_argument(
+        "-r",
+        "--regex",
+        type=lambda r: re.compile(r.encode("utf-8")),
+        metavar="RE",
+        help="MAC in the first group (or the whole match) of the regex RE",
+    )
+    lookup_group.add_argument(
+        "-n",
+        "--batch",
+        type=check_positive,
+        metavar="N",
+        help="lines processed per batch",
+        default=10000,
+    )
+    args = argParser.parse_args()
+    if args.incremental and not args.output:
+        argParser.error("--incremental requires --output")
+    if args.lookup:
+        if args.column and args.regex:
+            argParser.error("--column and --regex are mutually exclusive")
+        index = PrefixIndex.fromFile(args.lookup)
+        print(f"# Loaded {len(index)} prefixes from {args.lookup}.", file=sys.stderr)
+        begin = time.perf_counter()
+        try:
+            lines = annotate(
+                index,
+                sys.stdin.buffer,
+                sys.stdout.buffer,
+                args.column,
+                args.regex or MAC,
+                args.batch,
+            )
+        except BrokenPipeError:
+            # Output closed early, e.g., by head; silence the flush at exit.
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            exit(1)
+        elapsed = time.perf_counter() - begin
+        print(
+            f"# Annotated {lines} lines in {elapsed:.2f} s "
+            f"({lines / max(elapsed, 1e-9):.0f} lines/s).",
+            file=sys.stderr,
+        )
+        exit(0)
+    if not args.csv:
+        if os.isatty(sys.stdin.fileno()):
+            print("# Please provide oui.csv from a pipe.", file=sys.stderr)
+            exit(1)
+        args.csv = [sys.stdin]
+    if args.benchmark:
+        benchmark(args.csv)
+        exit(0)
+    if args.incremental:
+        incremental(args.csv, args.output, args.state or f"{args.output}.state")
+        OUIs = None
+    else:
+        header, OUIs = main(args.csv)
+        if args.output:
+            writeAtomically(args.output, render(header, OUIs))
+        else:
+            print(f"{header}")
+            print("\n".join(OUIs))
+    if args.index or args.database:
+        if OUIs is None:
+            with open(args.output, "r", encoding="utf-8") as file:
+                OUIs = file.read().splitlines()
+        index = PrefixIndex.fromLines(OUIs)
+        if args.index:
+            writeAtomically(args.index, index.dump())
+            print(f"# Wrote {len(index)} prefixes to {args.index}.", file=sys.stderr)
+        if args.database:
+            writeAtomically(args.database, index.pack())
+            print(f"# Wrote {len(index)} prefixes to {args.database}.", file=sys.stderr)
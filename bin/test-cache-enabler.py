@@ -4,18 +4,161 @@
 # Tests whether the Cache Enabler by KeyCDN (WordPress) is working properly on
 # the URLs given as arguments. Also takes line break separated URLs from a pipe.
 #
-# Usage: test-cache-enabler.py https://example.com [...]
+# Usage: test-cache-enabler.py [-zt] [-s f] [-j N] [-p N] https://example.com [...]
+#        test-cache-enabler.py -m https://example.com/sitemap.xml [-w] [-r f] [-j N]
+#        test-cache-enabler.py -d S [-i S] [-r f] [-j N] https://example.com [...]
+#        test-cache-enabler.py --benchmark N[,N...] [-z] [-j N] [--stub-* ...]
+#        test-cache-enabler.py --serve PORT [--stub-* ...]
+#
+#  -h, --help             show this help message and exit
+#  -z, --compressed       request compressed pages (gzip; br if brotli installed)
+#  -t, --timing           cold vs. cached latency columns & percentile summary
+#  -s f, --min-speedup f  highlight cached pages with a lower speedup (default: 1.2)
+#  -j N, --concurrency N  number of URLs checked in parallel (default: 1)
+#  -p N, --per-host N     maximum parallel checks per host (default: 4)
+#  -m URL, --sitemap URL  add URLs from a (gzipped) sitemap or sitemap index
+#  -w, --warm-only        cache warmer: only the warm-up requests, no checks
+#  -r f, --rate f         maximum warm-up (soak) requests per second per host
+#  -d S, --soak S         soak mode: request the URLs repeatedly for S seconds
+#  -i S, --interval S     soak report bucket length in seconds (default: 10)
+#
+# Local stub server & benchmark (no WordPress site needed):
+#  --benchmark N[,N...]   check N stub pages per run; URLs/s, bytes & peak memory
+#  --serve PORT           only run the stub server on 127.0.0.1:PORT (/pageN)
+#  --stub-size KB         stub page size in KiB (default: 50)
+#  --stub-latency MS      delay added to every stub response (default: 0)
+#  --stub-uncached f      share of stub pages without the marker (default: 0)
+#  --stub-errors f        share of stub responses that are HTTP 500 (default: 0)
+#  --stub-close           stub server closes the connection after each response
+#
+# The results are printed in the input order regardless of the concurrency.
+# Persistent (keep-alive) connections are reused per scheme, host & port.
+# Proxies from http_proxy, https_proxy & no_proxy are used like urllib does,
+# except by --benchmark: its stub server on 127.0.0.1 is always reached directly.
+# Response bodies are streamed in chunks; memory use is bounded by page size.
+# With --compressed the pre-compressed variants Cache Enabler serves to browsers
+# are tested (decompressed on the fly) & the Content-Encoding is reported.
+#
+# Timing columns: connect (DNS, TCP & TLS; 0 on a reused connection), time to
+# first byte & total time in milliseconds for the cold (first) & cached request.
+# The speedup compares the total times without the connection setup so that a
+# reused keep-alive connection alone does not look like a cache hit. It is only
+# measured when the cold request got an uncached page (otherwise -) & a speedup
+# below --min-speedup is highlighted in magenta.
+#
+# Post-deploy cache warming: --sitemap follows sitemap indexes & reads sitemaps
+# (also .xml.gz) as streams; --warm-only skips the checks & --rate paces the
+# requests per host with a token bucket so that the origin is not overloaded.
+#
+# Soak mode requests the URLs round-robin until the duration has passed & then
+# reports the hit ratio, cache regenerations (a changed cache time on a URL) &
+# the latency percentiles per interval; reveals evictions & expiring caches.
+#
+# The bundled stub server stands in for a WordPress site so that performance can
+# be measured reproducibly: --benchmark checks /page0.../pageN on it for each N
+# (e.g. 10,1000,100000) with the given -z, -j & -p; --serve runs it standalone.
 #
 # Author : Esa Jokinen (oh2fih)
 # Home   : https://github.com/oh2fih/Misc-Scripts
 # ------------------------------------------------------------------------------
 # flake8: noqa: E501
 
+import argparse
+import base64
+import collections
+import functools
+import http.client
+import itertools
+import math
 import os
+import random
 import re
+import ssl
 import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
 import urllib.request
-from typing import List
+import xml.etree.ElementTree as ElementTree
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from types import TracebackType
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+# Redirects followed per request, like urllib.request.
+MAX_REDIRECTS = 10
+
+# Socket timeout in seconds.
+TIMEOUT = 30.0
+
+# Bytes read at a time while streaming response bodies.
+CHUNK_SIZE = 65536
+
+# Cache Enabler comment & the bytes kept between chunks to find it across them.
+CACHE_MARKER = re.compile(b"<!-- Cache Enabler by KeyCDN (.*) -->")
+MARKER_WINDOW = 512
+
+USER_AGENT = f"Python-urllib/{sys.version_info[0]}.{sys.version_info[1]}"
+
+# Percentiles in the --timing summary.
+PERCENTILES = [50, 90, 99]
+
+# Width of the soak latency histogram bins; percentiles are within 1 %.
+HISTOGRAM_STEP = math.log(1.01)
+
+T = TypeVar("T")
+
+
+class Timing(NamedTuple):
+    """Request phases in seconds"""
+
+    connect: float
+    ttfb: float
+    total: float
+
+
+class CheckResult(NamedTuple):
+    """Result text & its color with the timings of the cold & cached requests;
+    precached tells that the cold request already got a cached page"""
+
+    result: str
+    SGR: int
+    cold: Optional[Timing]
+    warm: Optional[Timing]
+    precached: bool
+
+    def speedup(self) -> Optional[float]:
+        """Cold/cached ratio of the total time without the connection setup;
+        only the cold request opens a connection, the cached one reuses it"""
+        if self.cold is None or self.warm is None or self.precached:
+            return None
+        warm = self.warm.total - self.warm.connect
+        if warm <= 0:
+            return None
+        return (self.cold.total - self.cold.connect) / warm
+
+
+class StubConfig(NamedTuple):
+    size: int
+    latency: float
+    uncached: float
+    errors: float
+    close: bool
+
 
 try:
     import validators  # type: ignore
@@ -27,21 +170,52 @@ except ImportError:
             return True
 
 
-def main(urllist: List[str]) -> None:
+try:
+    import brotli  # type: ignore
+
+    ACCEPT_ENCODING = "br, gzip"
+except ImportError:
+    ACCEPT_ENCODING = "gzip"
+
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore
+
+
+def main(
+    urllist: List[str],
+    concurrency: int = 1,
+    perhost: int = 4,
+    compressed: bool = False,
+    timing: bool = False,
+    minspeedup: float = 1.2,
+    sitemaps: Optional[List[str]] = None,
+    warmonly: bool = False,
+    rate: Optional[float] = None,
+    soak: Optional[float] = None,
+    interval: float = 10.0,
+) -> None:
     """Causes the pages to be cached, gets them and prints the results as a table."""
 
     # Enable ANSI colors on Windows.
     if os.name == "nt":
         os.system("color")
 
+    pool = ConnectionPool()
+    for sitemap in sitemaps or []:
+        urllist.extend(readSitemap(sitemap, pool))
+
     # Strip whitespace and adjust the output column to the longest URL.
     # Remove invalid URLs if optional 'validators' module is imported.
     maxlength = 2
     validurls = []
+    seen = set()
     for url in urllist:
         url = url.strip(" \n\r\t")
         if validators.url(url) and url != "":
-            if url not in validurls:
+            if url not in seen:
+                seen.add(url)
                 validurls.append(url)
                 if len(url) > maxlength:
                     maxlength = len(url)
@@ -52,28 +226,776 @@ def main(urllist: List[str]) -> None:
     if len(validurls) == 0:
         usage()
 
+    ratelimiter = RateLimiter(rate) if rate else None
+    if soak:
+        report = soakUrls(
+            validurls,
+            pool,
+            soak,
+            concurrency,
+            perhost,
+            compressed,
+            ratelimiter,
+            interval,
+        )
+        pool.close()
+        printSoakReport(report)
+        return
+
     print(f"{os.linesep}{ansi(1)}", end="")
-    printResultLine("URL", "RESULT", maxlength, 1)
-    for url in validurls:
+    header = f"{'WARM-UP ms (conn/ttfb/total)':<29}"
+    if not warmonly:
+        header = f"{'COLD ms (conn/ttfb/total)':<29}"
+        header += f"{'CACHED ms (conn/ttfb/total)':<29}{'SPEEDUP':<9}"
+    printResultLine("URL", "RESULT", maxlength, 1, header if timing else "")
+    limiter = HostLimiter(perhost)
+    check = functools.partial(
+        checkUrl,
+        pool=pool,
+        compressed=compressed,
+        warmonly=warmonly,
+        ratelimiter=ratelimiter,
+    )
+    results = []
+    begin = time.perf_counter()
+    for url, result in zip(
+        validurls, checkUrls(validurls, check, concurrency, limiter)
+    ):
+        results.append(result)
+        columns = ""
+        if timing:
+            # Cached, but without a real latency gain: the speedup in magenta.
+            speedup = result.speedup()
+            slow = result.SGR == 92 and speedup is not None and speedup < minspeedup
+            columns = formatTimings(result, 95 if slow else result.SGR)
+        if warmonly:
+            columns = columns[:29]
+        printResultLine(url, result.result, maxlength, result.SGR, columns)
+    elapsed = time.perf_counter() - begin
+    pool.close()
+    print(
+        f"{os.linesep}Connections: {pool.opened} opened, {pool.reused} reused.",
+        end=os.linesep * 2,
+    )
+    if warmonly:
+        errors = sum(1 for r in results if r.SGR == 91)
+        print(
+            f"Warmed {len(results) - errors} pages ({errors} errors) in "
+            f"{elapsed:.1f} s; {len(results) / elapsed:.1f} pages/s.",
+            end=os.linesep * 2,
+        )
+    elif timing:
+        printTimingSummary(results, minspeedup)
+
+
+def checkUrls(
+    urls: List[str],
+    check: Callable[[str], CheckResult],
+    concurrency: int,
+    limiter: "HostLimiter",
+) -> Iterator[CheckResult]:
+    """Checks the URLs in parallel; yields the results in the input order"""
+    # Bounded window of submitted checks; memory does not grow with the URLs.
+    window = concurrency * 4
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures: Deque["Future[CheckResult]"] = collections.deque()
+        for url in urls:
+            futures.append(executor.submit(limiter.run, check, url))
+            if len(futures) >= window:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+def checkUrl(
+    url: str,
+    pool: "ConnectionPool",
+    compressed: bool = False,
+    warmonly: bool = False,
+    ratelimiter: Optional["RateLimiter"] = None,
+) -> CheckResult:
+    """Causes the page to be cached & checks it. Returns the result & its color."""
+    headers = {"Accept-Encoding": ACCEPT_ENCODING} if compressed else {}
+    cold = None
+    precached = False
+    try:
+        # Initial request to cause Cache Enabler to cache the page.
+        if ratelimiter:
+            ratelimiter.wait(url)
+        begin = time.perf_counter()
+        with pool.request(url, headers) as response:
+            if warmonly:
+                response.discard()
+            else:
+                precached = scanCacheTime(response) != "Not cached."
+        cold = response.timing(time.perf_counter() - begin)
+        if warmonly:
+            return CheckResult("Warmed.", 92, cold, None, precached)
+        # Get the cached page for processing.
+        begin = time.perf_counter()
+        with pool.request(url, headers) as response:
+            result = scanCacheTime(response)
+        warm = response.timing(time.perf_counter() - begin)
+        if compressed:
+            encoding = response.encoding() or "uncompressed"
+            result = f"{result} [{encoding}]"
+        if result.startswith("Not cached."):
+            return CheckResult(result, 93, cold, warm, precached)
+        else:
+            return CheckResult(result, 92, cold, warm, precached)
+    except Exception as e:
+        return CheckResult(str(e), 91, cold, None, precached)
+
+
+def soakUrls(
+    urls: List[str],
+    pool: "ConnectionPool",
+    duration: float,
+    concurrency: int = 1,
+    perhost: int = 4,
+    compressed: bool = False,
+    ratelimiter: Optional["RateLimiter"] = None,
+    interval: float = 10.0,
+) -> "SoakReport":
+    """Requests the URLs round-robin until the duration has passed"""
+    headers = {"Accept-Encoding": ACCEPT_ENCODING} if compressed else {}
+    limiter = HostLimiter(perhost)
+    report = SoakReport(interval, duration)
+    lock = threading.Lock()
+    cycle = itertools.cycle(urls)
+    begin = time.perf_counter()
+    deadline = begin + duration
+
+    def request(url: str) -> None:
+        if ratelimiter:
+            ratelimiter.wait(url)
+        start = time.perf_counter()
+        if start >= deadline:
+            # The soak ended while waiting for the rate limiter.
+            return
         try:
-            # Initial request to cause Cache Enabler to cache the page.
-            urllib.request.urlopen(url)
-            # Get the cached page for processing.
-            with urllib.request.urlopen(url) as response:
-                page = response.read()
-                result = str(getCacheTime(page))
-                if result == "Not cached.":
-                    printResultLine(url, result, maxlength, 93)
-                else:
-                    printResultLine(url, result, maxlength, 92)
-        except Exception as e:
-            printResultLine(url, str(e), maxlength, 91)
-    print()
+            with pool.request(url, headers) as response:
+                result = scanCacheTime(response)
+            cachetime = None if result == "Not cached." else result
+        except Exception:
+            report.add(start - begin, url, None, None)
+            return
+        report.add(start - begin, url, cachetime, time.perf_counter() - start)
+
+    def worker() -> None:
+        while time.perf_counter() < deadline:
+            with lock:
+                url = next(cycle)
+            limiter.run(request, url)
+
+    print(
+        f"{os.linesep}Soaking {len(urls)} URLs for {duration:g} s "
+        f"with {concurrency} worker(s)...",
+        end=os.linesep * 2,
+    )
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    print(
+        f"Connections: {pool.opened} opened, {pool.reused} reused.", end=os.linesep * 2
+    )
+    return report
+
+
+def readSitemap(url: str, pool: "ConnectionPool") -> List[str]:
+    """Page URLs from a sitemap; sitemap indexes are followed recursively"""
+    urls = []
+    queue = [url]
+    visited = set()
+    while queue:
+        sitemap = queue.pop(0)
+        if sitemap in visited:
+            continue
+        visited.add(sitemap)
+        try:
+            with pool.request(sitemap, {"Accept-Encoding": "gzip"}) as response:
+                for loc, index in parseSitemap(response.content()):
+                    if index:
+                        queue.append(loc)
+                    else:
+                        urls.append(loc)
+        except (
+            OSError,
+            http.client.HTTPException,
+            ElementTree.ParseError,
+            zlib.error,
+        ) as e:
+            print(f"{ansi(91)}Sitemap {sitemap} failed: {e}{ansi(0)}")
+    print(f"Found {len(urls)} URLs in {len(visited)} sitemap(s) of {url}")
+    return urls
+
+
+def parseSitemap(chunks: Iterator[bytes]) -> Iterator[Tuple[str, bool]]:
+    """Streams (loc, is sitemap index) from XML or gzipped XML chunks"""
+    parser: "ElementTree.XMLPullParser[ElementTree.Element]"
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    chunks = iter(chunks)
+    first = next(chunks, b"")
+    chunks = itertools.chain([first], chunks)
+    if first[:2] == b"\x1f\x8b":
+        # A .xml.gz file served as is, not with Content-Encoding.
+        chunks = gunzipChunks(chunks)
+    root: Optional[ElementTree.Element] = None
+    index = False
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event in parser.read_events():
+            element = event[-1]
+            if not isinstance(element, ElementTree.Element):
+                continue
+            tag = element.tag.rsplit("}", 1)[-1]
+            if event[0] == "start":
+                if root is None:
+                    root = element
+                    index = tag == "sitemapindex"
+            elif tag == "loc" and element.text:
+                yield element.text.strip(), index
+            elif tag in ("url", "sitemap") and root is not None:
+                # Detach the parsed entries; memory does not grow with the file.
+                root.clear()
+    parser.close()
+
+
+def gunzipChunks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """Decompresses gzip in pieces of at most CHUNK_SIZE bytes"""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        while chunk:
+            yield decompressor.decompress(chunk, CHUNK_SIZE)
+            chunk = decompressor.unconsumed_tail
+    yield decompressor.flush()
+
+
+class RateLimiter:
+    """Token bucket per host; allows bursts of up to one second of requests"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.burst = max(1.0, rate)
+        self.lock = threading.Lock()
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+
+    def wait(self, url: str) -> None:
+        """Takes a token for the host of the URL; sleeps until it is available"""
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        with self.lock:
+            now = time.monotonic()
+            tokens, updated = self.buckets.get(host, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate) - 1
+            self.buckets[host] = (tokens, now)
+        if tokens < 0:
+            time.sleep(-tokens / self.rate)
+
+
+class SoakStats:
+    """Request counters & a log-scale latency histogram of one soak interval"""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.hits = 0
+        self.regenerations = 0
+        self.errors = 0
+        self.histogram: Dict[int, int] = {}
+
+    def add(self, hit: bool, regenerated: bool, latency: Optional[float]) -> None:
+        self.requests += 1
+        if latency is None:
+            self.errors += 1
+            return
+        self.hits += hit
+        self.regenerations += regenerated
+        step = round(math.log(max(latency, 1e-6)) / HISTOGRAM_STEP)
+        self.histogram[step] = self.histogram.get(step, 0) + 1
+
+    def merge(self, other: "SoakStats") -> None:
+        self.requests += other.requests
+        self.hits += other.hits
+        self.regenerations += other.regenerations
+        self.errors += other.errors
+        for step, count in other.histogram.items():
+            self.histogram[step] = self.histogram.get(step, 0) + count
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Nearest-rank percentile of the latencies; None without any"""
+        succeeded = self.requests - self.errors
+        rank = max(1, math.ceil(p / 100 * succeeded))
+        for step in sorted(self.histogram):
+            rank -= self.histogram[step]
+            if rank <= 0:
+                return math.exp(step * HISTOGRAM_STEP)
+        return None
+
+
+class SoakReport:
+    """Soak results aggregated per interval as they arrive"""
+
+    def __init__(self, interval: float, duration: float):
+        self.interval = interval
+        self.duration = duration
+        self.lock = threading.Lock()
+        self.buckets: Dict[int, SoakStats] = {}
+        # Latest cache time seen per URL, with the offset of its request.
+        self.cachetimes: Dict[str, Tuple[float, str]] = {}
+
+    def add(
+        self,
+        offset: float,
+        url: str,
+        cachetime: Optional[str],
+        latency: Optional[float],
+    ) -> None:
+        with self.lock:
+            # A changed cache time means the cached page was regenerated in between.
+            regenerated = False
+            if cachetime is not None:
+                last = self.cachetimes.get(url)
+                if last is None or last[0] <= offset:
+                    regenerated = last is not None and last[1] != cachetime
+                    self.cachetimes[url] = (offset, cachetime)
+            bucket = self.buckets.setdefault(int(offset // self.interval), SoakStats())
+            bucket.add(cachetime is not None, regenerated, latency)
+
+
+class ConnectionPool:
+    """Persistent HTTP(S) connections kept idle per (scheme, host, port)"""
+
+    def __init__(self, timeout: float = TIMEOUT, proxies: bool = True):
+        self.timeout = timeout
+        self.context = ssl.create_default_context()
+        self.lock = threading.Lock()
+        self.idle: Dict[Tuple[str, str, int], List[http.client.HTTPConnection]] = {}
+        self.proxies = urllib.request.getproxies() if proxies else {}
+        self.bypass: Dict[str, bool] = {}
+        self.opened = 0
+        self.reused = 0
+
+    def request(
+        self, url: str, headers: Optional[Dict[str, str]] = None
+    ) -> "PooledResponse":
+        """GET the URL following redirects; HTTPError on error statuses"""
+        begin = time.perf_counter()
+        connect = 0.0
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self.get(url, headers)
+            # Connection setup of all the hops & time to the final response.
+            connect += response.connect
+            response.connect = connect
+            response.ttfb = time.perf_counter() - begin
+            location = response.response.getheader("Location")
+            status = response.response.status
+            if status in (301, 302, 303, 307, 308) and location:
+                response.drain()
+                url = urllib.parse.urljoin(url, location)
+                continue
+            if status >= 400:
+                response.drain()
+                raise urllib.error.HTTPError(
+                    url, status, response.response.reason, response.response.msg, None
+                )
+            return response
+        raise urllib.error.URLError(f"too many redirects ({MAX_REDIRECTS})")
+
+    def get(
+        self, url: str, headers: Optional[Dict[str, str]] = None
+    ) -> "PooledResponse":
+        """Single GET request; retries once on a fresh connection if a reused
+        connection has been closed by the server in the meantime"""
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise urllib.error.URLError(f"unknown url type: {url}")
+        default = 443 if parts.scheme == "https" else 80
+        key = (parts.scheme, parts.hostname.lower(), parts.port or default)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        headers = {"User-Agent": USER_AGENT, **(headers or {})}
+        proxy = self.proxy(key)
+        if proxy and parts.scheme == "http":
+            # Plain HTTP proxies take the absolute URL; HTTPS is tunneled.
+            path = f"http://{parts.netloc.rsplit('@', 1)[-1]}{path}"
+            headers.update(proxy[2])
+
+        while True:
+            connection, reused = self.acquire(key)
+            try:
+                connect = 0.0
+                if not reused:
+                    begin = time.perf_counter()
+                    connection.connect()
+                    connect = time.perf_counter() - begin
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                if reused:
+                    with self.lock:
+                        self.reused += 1
+                pooled = PooledResponse(self, key, connection, response)
+                pooled.connect = connect
+                return pooled
+            except (ConnectionError, http.client.BadStatusLine):
+                connection.close()
+                if not reused:
+                    raise
+            except BaseException:
+                connection.close()
+                raise
+
+    def acquire(
+        self, key: Tuple[str, str, int]
+    ) -> Tuple[http.client.HTTPConnection, bool]:
+        """Idle connection for the key if any, otherwise a new one"""
+        with self.lock:
+            if self.idle.get(key):
+                return self.idle[key].pop(), True
+            self.opened += 1
+        scheme, host, port = key
+        proxy = self.proxy(key)
+        if proxy:
+            proxyhost, proxyport, authorization = proxy
+            if scheme == "https":
+                connection = http.client.HTTPSConnection(
+                    proxyhost, proxyport, timeout=self.timeout, context=self.context
+                )
+                connection.set_tunnel(host, port, headers=authorization)
+                return connection, False
+            return (
+                http.client.HTTPConnection(proxyhost, proxyport, timeout=self.timeout),
+                False,
+            )
+        if scheme == "https":
+            return (
+                http.client.HTTPSConnection(
+                    host, port, timeout=self.timeout, context=self.context
+                ),
+                False,
+            )
+        return http.client.HTTPConnection(host, port, timeout=self.timeout), False
+
+    def proxy(
+        self, key: Tuple[str, str, int]
+    ) -> Optional[Tuple[str, int, Dict[str, str]]]:
+        """Proxy host, port & Proxy-Authorization header for the key, if any"""
+        scheme, host, _ = key
+        proxy = self.proxies.get(scheme)
+        if not proxy:
+            return None
+        with self.lock:
+            if host not in self.bypass:
+                self.bypass[host] = bool(urllib.request.proxy_bypass(host))
+            if self.bypass[host]:
+                return None
+        if "://" not in proxy:
+            proxy = f"http://{proxy}"
+        parts = urllib.parse.urlsplit(proxy)
+        if not parts.hostname:
+            return None
+        authorization = {}
+        if parts.username is not None:
+            credentials = urllib.parse.unquote(parts.username)
+            credentials += f":{urllib.parse.unquote(parts.password or '')}"
+            token = base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+            authorization["Proxy-Authorization"] = f"Basic {token}"
+        default = 443 if parts.scheme == "https" else 80
+        return parts.hostname, parts.port or default, authorization
+
+    def release(
+        self, key: Tuple[str, str, int], connection: http.client.HTTPConnection
+    ) -> None:
+        """Return a connection with a fully read response back to the pool"""
+        with self.lock:
+            self.idle.setdefault(key, []).append(connection)
+
+    def close(self) -> None:
+        """Close all the idle connections"""
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle = {}
+
+
+class PooledResponse:
+    """Response that hands its connection back to the pool when closed"""
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        key: Tuple[str, str, int],
+        connection: http.client.HTTPConnection,
+        response: http.client.HTTPResponse,
+    ):
+        self.pool = pool
+        self.key = key
+        self.connection: Optional[http.client.HTTPConnection] = connection
+        self.response = response
+        self.connect = 0.0
+        self.ttfb = 0.0
+
+    def timing(self, total: float) -> Timing:
+        return Timing(self.connect, self.ttfb, total)
+
+    def read(self, amount: Optional[int] = None) -> bytes:
+        return self.response.read(amount)
+
+    def encoding(self) -> str:
+        """Content-Encoding of the response; empty if not compressed"""
+        encoding = self.response.getheader("Content-Encoding", "")
+        return encoding.strip().lower()
+
+    def content(self) -> Iterator[bytes]:
+        """Stream the body in decompressed chunks of at most CHUNK_SIZE bytes"""
+        encoding = self.encoding()
+        if encoding in ("", "identity"):
+            while True:
+                chunk = self.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+        elif encoding in ("gzip", "x-gzip", "deflate"):
+            # Automatic gzip/zlib header detection; max_length bounds the output.
+            decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+            while True:
+                chunk = self.read(CHUNK_SIZE)
+                if not chunk:
+                    yield decompressor.flush()
+                    return
+                while chunk:
+                    yield decompressor.decompress(chunk, CHUNK_SIZE)
+                    chunk = decompressor.unconsumed_tail
+        elif encoding == "br" and ACCEPT_ENCODING.startswith("br"):
+            processor = brotli.Decompressor()
+            while True:
+                chunk = self.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield processor.process(chunk)
+        else:
+            raise urllib.error.URLError(f"unsupported Content-Encoding: {encoding}")
+
+    def discard(self) -> int:
+        """Read the rest of the body into a reused buffer; return the bytes read"""
+        buffer = memoryview(bytearray(CHUNK_SIZE))
+        total = 0
+        while True:
+            count = self.response.readinto(buffer)
+            if not count:
+                return total
+            total += count
+
+    def drain(self) -> None:
+        """Discard the rest of the body & release the connection"""
+        try:
+            self.discard()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Reuse the connection only if the response was read completely"""
+        connection, self.connection = self.connection, None
+        if connection is None:
+            return
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.release(self.key, connection)
+        else:
+            self.response.close()
+            connection.close()
+
+    def __enter__(self) -> "PooledResponse":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+
+class HostLimiter:
+    """Caps the number of concurrent checks per host with a semaphore per host"""
+
+    def __init__(self, perhost: int):
+        self.perhost = perhost
+        self.lock = threading.Lock()
+        self.semaphores: Dict[str, threading.Semaphore] = {}
+
+    def run(self, function: Callable[[str], T], url: str) -> T:
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.Semaphore(self.perhost)
+            semaphore = self.semaphores[host]
+        with semaphore:
+            return function(url)
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """Local stand-in for a WordPress site with Cache Enabler for benchmarks"""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, port: int, config: StubConfig):
+        super().__init__(("127.0.0.1", port), StubHandler)
+        self.config = config
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.sent = 0
+        self.pages: Dict[Tuple[bool, bool], bytes] = {}
+        for cached in (True, False):
+            marker = b""
+            if cached:
+                marker = (
+                    b"<!-- Cache Enabler by KeyCDN @ "
+                    + time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime()).encode()
+                    + b" (https-index.html) -->"
+                )
+            filler = b"<p>Lorem ipsum dolor sit amet.</p>\n" * (
+                config.size * 1024 // 36
+            )
+            page = b"<!DOCTYPE html>\n<html><body>\n" + filler + b"</body></html>\n"
+            self.pages[(cached, False)] = page + marker
+            # Compressible like real HTML, so the gzip variant is realistic.
+            self.pages[(cached, True)] = gzipCompress(page + marker)
+
+    def count(self, sent: int) -> None:
+        with self.lock:
+            self.requests += 1
+            self.sent += sent
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves /pageN; the configuration decides marker, latency & errors"""
+
+    protocol_version = "HTTP/1.1"
+    # Like web servers on keep-alive connections; avoids delayed ACK stalls.
+    disable_nagle_algorithm = True
+    server: StubServer
+
+    def do_GET(self) -> None:
+        config = self.server.config
+        if config.latency:
+            time.sleep(config.latency / 1000)
+        if config.errors and random.random() < config.errors:
+            self.reply(500, b"Internal Server Error", {})
+            return
+        # The same pages are always uncached; deterministic across requests.
+        cached = zlib.crc32(self.path.encode()) / 2**32 >= config.uncached
+        # Only gzip variants, whatever else ACCEPT_ENCODING would prefer.
+        compressed = "gzip" in self.headers.get("Accept-Encoding", "")
+        headers = {"Content-Type": "text/html; charset=UTF-8"}
+        if compressed:
+            headers["Content-Encoding"] = "gzip"
+        self.reply(200, self.server.pages[(cached, compressed)], headers)
+
+    def reply(self, status: int, body: bytes, headers: Dict[str, str]) -> None:
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        if self.server.config.close:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(len(body))
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+def gzipCompress(data: bytes) -> bytes:
+    """Gzip compressed data; gzip.compress() without the gzip module"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def serveStub(port: int, config: StubConfig) -> None:
+    """Runs the stub server in the foreground until interrupted"""
+    server = StubServer(port, config)
+    print(
+        f"Serving stub pages on http://127.0.0.1:{server.server_address[1]}/pageN "
+        f"(Ctrl+C to stop)"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"{os.linesep}Served {server.requests} requests, {server.sent} bytes.")
+
+
+def benchmark(
+    sizes: List[int],
+    config: StubConfig,
+    concurrency: int = 1,
+    perhost: int = 4,
+    compressed: bool = False,
+) -> None:
+    """Checks growing numbers of stub pages; prints throughput & peak memory"""
+    server = StubServer(0, config)
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(
+        f"{os.linesep}Stub: {config.size} KiB pages, {config.latency:g} ms latency, "
+        f"{config.uncached:g} uncached, {config.errors:g} errors, "
+        f"{'no ' if config.close else ''}keep-alive; "
+        f"concurrency {concurrency}, {'gzip' if compressed else 'uncompressed'}.",
+        end=os.linesep * 2,
+    )
+    print(
+        f"{ansi(1)}{'URLS':>8}{'SECONDS':>10}{'URLS/S':>10}{'REQUESTS':>10}"
+        f"{'MB SENT':>10}{'OPENED':>8}{'CACHED':>8}{'ERRORS':>8}"
+        f"{'PEAK MB':>9}{ansi(0)}"
+    )
+    for size in sorted(sizes):
+        urls = [f"http://127.0.0.1:{port}/page{i}" for i in range(size)]
+        pool = ConnectionPool(proxies=False)
+        check = functools.partial(checkUrl, pool=pool, compressed=compressed)
+        with server.lock:
+            server.requests = server.sent = 0
+        begin = time.perf_counter()
+        cached = errors = 0
+        for result in checkUrls(urls, check, concurrency, HostLimiter(perhost)):
+            if result.SGR == 92:
+                cached += 1
+            elif result.SGR == 91:
+                errors += 1
+        elapsed = time.perf_counter() - begin
+        pool.close()
+        print(
+            f"{size:>8}{elapsed:>10.2f}{size / elapsed:>10.0f}{server.requests:>10}"
+            f"{server.sent / 2**20:>10.1f}{pool.opened:>8}{cached:>8}{errors:>8}"
+            f"{peakMemory():>9}"
+        )
+    server.shutdown()
+    server.server_close()
+    print(
+        f"{os.linesep}PEAK MB is the maximum resident set size of the whole "
+        f"process (including the stub server) so far.",
+        end=os.linesep * 2,
+    )
+
+
+def peakMemory() -> str:
+    """Peak resident set size in MiB or '-' if not available (Windows)"""
+    if resource is None:
+        return "-"
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kibibytes, macOS bytes.
+    divisor = 2**20 if sys.platform == "darwin" else 2**10
+    return f"{peak / divisor:.0f}"
 
 
 def getCacheTime(page: bytes) -> str:
     """Parses the cache time from the Cache Enabler comment on a HTML page."""
-    result = re.search(b"<!-- Cache Enabler by KeyCDN (.*) -->", page)
+    result = CACHE_MARKER.search(page)
     if result:
         cached = result.group(1)
         return cached.decode("utf-8")
@@ -81,10 +1003,126 @@ def getCacheTime(page: bytes) -> str:
         return "Not cached."
 
 
-def printResultLine(url: str, result: str, urlmaxlenght: int, SGR: int) -> None:
+def scanCacheTime(response: PooledResponse) -> str:
+    """Streams the body in chunks with a rolling window for the getCacheTime()"""
+    tail = b""
+    for chunk in response.content():
+        window = tail + chunk
+        result = getCacheTime(window)
+        if result != "Not cached.":
+            response.discard()
+            return result
+        tail = window[-MARKER_WINDOW:]
+    return "Not cached."
+
+
+def printResultLine(
+    url: str, result: str, urlmaxlenght: int, SGR: int, columns: str = ""
+) -> None:
     """Prints table formatted result line & ANSI colors."""
     width = urlmaxlenght + 2
-    print(f"{url:{width}}{ansi(SGR)}{result:<10}{ansi(0)}")
+    print(f"{url:{width}}{columns}{ansi(SGR)}{result:<10}{ansi(0)}")
+
+
+def formatTimings(result: CheckResult, SGR: int) -> str:
+    """Timing columns in milliseconds & the speedup of the cached request"""
+    columns = ""
+    for timing in (result.cold, result.warm):
+        if timing is None:
+            columns += f"{'-':<29}"
+        else:
+            phases = "/".join(f"{t * 1000:.0f}" for t in timing)
+            columns += f"{phases:<29}"
+    speedup = result.speedup()
+    if speedup is None:
+        return f"{columns}{'-':<9}"
+    return f"{columns}{ansi(SGR)}{speedup:<9.2f}{ansi(0)}"
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of the values"""
+    ordered = sorted(values)
+    rank = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def printTimingSummary(results: List[CheckResult], minspeedup: float) -> None:
+    """Prints latency percentiles across all the successfully checked URLs"""
+    measured = [r for r in results if r.cold is not None and r.warm is not None]
+    if not measured:
+        return
+    rows: List[Tuple[str, List[float], float]] = []
+    for title, index in (("connect", 0), ("ttfb", 1), ("total", 2)):
+        rows.append(
+            (f"cold {title} ms", [r.cold[index] for r in measured if r.cold], 1000)
+        )
+        rows.append(
+            (f"cached {title} ms", [r.warm[index] for r in measured if r.warm], 1000)
+        )
+    speedups = [r.speedup() for r in measured]
+    rows.append(("speedup", [s for s in speedups if s is not None], 1))
+
+    titles = "".join(f"{'p' + str(p):>10}" for p in PERCENTILES)
+    print(
+        f"{ansi(1)}{'LATENCY (' + str(len(measured)) + ' URLs)':<20}{titles}{ansi(0)}"
+    )
+    for title, values, scale in rows:
+        if values:
+            cells = "".join(
+                f"{percentile(values, p) * scale:>10.2f}" for p in PERCENTILES
+            )
+            print(f"{title:<20}{cells}")
+
+    slow = [
+        r for r in measured if r.SGR == 92 and (r.speedup() or minspeedup) < minspeedup
+    ]
+    if slow:
+        print(
+            f"{os.linesep}{ansi(95)}{len(slow)} cached page(s) without a real "
+            f"latency gain (speedup < {minspeedup}).{ansi(0)}"
+        )
+    precached = sum(1 for r in measured if r.precached)
+    if precached:
+        print(
+            f"{os.linesep}{precached} page(s) were already cached on the cold "
+            f"request; no speedup measured."
+        )
+    print()
+
+
+def printSoakReport(report: SoakReport) -> None:
+    """Prints hit ratio, regenerations & latency percentiles per time bucket"""
+    titles = "".join(f"{'p' + str(p) + ' ms':>10}" for p in PERCENTILES)
+    print(
+        f"{ansi(1)}{'SECONDS':<14}{'REQUESTS':>9}{'HIT %':>8}{'REGEN':>7}"
+        f"{'ERRORS':>8}{titles}{ansi(0)}"
+    )
+    interval = report.interval
+    total = SoakStats()
+    for index in sorted(report.buckets) + [-1]:
+        if index >= 0:
+            stats = report.buckets[index]
+            total.merge(stats)
+            end = min((index + 1) * interval, report.duration)
+            title = f"{index * interval:g}-{end:g}"
+        else:
+            stats = total
+            title = "total"
+        succeeded = stats.requests - stats.errors
+        ratio = f"{100 * stats.hits / succeeded:.1f}" if succeeded else "-"
+        cells = ""
+        for p in PERCENTILES:
+            latency = stats.percentile(p)
+            cells += f"{latency * 1000:>10.2f}" if latency is not None else f"{'-':>10}"
+        if index < 0:
+            SGR = 1
+        else:
+            SGR = 91 if stats.errors else 93 if stats.hits < succeeded else 0
+        print(
+            f"{ansi(SGR)}{title:<14}{stats.requests:>9}{ratio:>8}"
+            f"{stats.regenerations:>7}{stats.errors:>8}{cells}{ansi(0)}"
+        )
+    print()
 
 
 def ansi(SGR: int = 0) -> str:
@@ -95,19 +1133,207 @@ def ansi(SGR: int = 0) -> str:
 
 
 def usage() -> None:
-    print(f"{os.linesep}Usage: {sys.argv[0]} https://example.com [...]")
+    print(
+        f"{os.linesep}Usage: {sys.argv[0]} [-zt] [-s f] [-j N] [-p N] https://example.com [...]"
+        f"{os.linesep}       {sys.argv[0]} -m https://example.com/sitemap.xml [-w] [-r f]"
+        f"{os.linesep}       {sys.argv[0]} -d S [-i S] [-r f] https://example.com [...]"
+        f"{os.linesep}       {sys.argv[0]} --benchmark N[,N...] | --serve PORT"
+    )
     print(f"{os.linesep}Also takes line break separated URLs from a pipe.{os.linesep}")
     exit(1)
 
 
+def check_positive(value: str) -> int:
+    ivalue = int(value)
+    if ivalue <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return ivalue
+
+
+def check_positive_float(value: str) -> float:
+    fvalue = float(value)
+    if fvalue <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return fvalue
+
+
+def check_sizes(value: str) -> List[int]:
+    try:
+        sizes = [int(size) for size in value.split(",")]
+    except ValueError:
+        sizes = []
+    if not sizes or min(sizes) <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a list of positive integers")
+    return sizes
+
+
 if __name__ == "__main__":
-    urllist = []
-    if len(sys.argv) == 1:
+    argParser = argparse.ArgumentParser(
+        description="Tests whether the Cache Enabler by KeyCDN (WordPress) "
+        "is working properly on the URLs.",
+        usage="%(prog)s [-hztw] [-s f] [-j N] [-p N] [-m URL] [-r f] [-d S] "
+        "[-i S] [--benchmark N[,N...] | --serve PORT] [--stub-* ...] "
+        "[https://example.com ...]",
+        epilog="Also takes line break separated URLs from a pipe.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    argParser.add_argument("urls", nargs="*", metavar="URL", help="URLs to test")
+    argParser.add_argument(
+        "-z",
+        "--compressed",
+        action="store_true",
+        help=f"request compressed pages ({ACCEPT_ENCODING}) & report the encoding",
+        default=False,
+    )
+    argParser.add_argument(
+        "-t",
+        "--timing",
+        action="store_true",
+        help="cold vs. cached latency columns & percentile summary",
+        default=False,
+    )
+    argParser.add_argument(
+        "-s",
+        "--min-speedup",
+        type=float,
+        metavar="f",
+        help="highlight cached pages with a lower cold/cached speedup",
+        default=1.2,
+    )
+    argParser.add_argument(
+        "-j",
+        "--concurrency",
+        type=check_positive,
+        metavar="N",
+        help="number of URLs checked in parallel",
+        default=1,
+    )
+    argParser.add_argument(
+        "-p",
+        "--per-host",
+        type=check_positive,
+        metavar="N",
+        help="maximum parallel checks per host",
+        default=4,
+    )
+    argParser.add_argument(
+        "-m",
+        "--sitemap",
+        action="append",
+        metavar="URL",
+        help="add URLs from a (gzipped) sitemap or sitemap index; repeatable",
+    )
+    argParser.add_argument(
+        "-w",
+        "--warm-only",
+        action="store_true",
+        help="cache warmer: only the warm-up requests, no checks",
+        default=False,
+    )
+    argParser.add_argument(
+        "-r",
+        "--rate",
+        type=check_positive_float,
+        metavar="f",
+        help="maximum warm-up (soak) requests per second per host",
+    )
+    argParser.add_argument(
+        "-d",
+        "--soak",
+        type=check_positive_float,
+        metavar="S",
+        help="soak mode: request the URLs repeatedly for S seconds",
+    )
+    argParser.add_argument(
+        "-i",
+        "--interval",
+        type=check_positive_float,
+        metavar="S",
+        help="soak report bucket length in seconds",
+        default=10.0,
+    )
+    stubGroup = argParser.add_argument_group(
+        "local stub server & benchmark (no WordPress site needed)"
+    )
+    stubGroup.add_argument(
+        "--benchmark",
+        type=check_sizes,
+        metavar="N[,N...]",
+        help="check N stub pages per run; report URLs/s, bytes & peak memory",
+    )
+    stubGroup.add_argument(
+        "--serve",
+        type=int,
+        metavar="PORT",
+        help="only run the stub server on 127.0.0.1:PORT (pages /page0, /page1...)",
+    )
+    stubGroup.add_argument(
+        "--stub-size",
+        type=check_positive,
+        metavar="KB",
+        help="stub page size in KiB",
+        default=50,
+    )
+    stubGroup.add_argument(
+        "--stub-latency",
+        type=float,
+        metavar="MS",
+        help="delay added to every stub response in milliseconds",
+        default=0.0,
+    )
+    stubGroup.add_argument(
+        "--stub-uncached",
+        type=float,
+        metavar="f",
+        help="share of stub pages without the Cache Enabler marker",
+        default=0.0,
+    )
+    stubGroup.add_argument(
+        "--stub-errors",
+        type=float,
+        metavar="f",
+        help="share of stub responses that are HTTP 500 errors",
+        default=0.0,
+    )
+    stubGroup.add_argument(
+        "--stub-close",
+        action="store_true",
+        help="stub server closes the connection after each response (no keep-alive)",
+        default=False,
+    )
+    args = argParser.parse_args()
+    config = StubConfig(
+        args.stub_size,
+        args.stub_latency,
+        args.stub_uncached,
+        args.stub_errors,
+        args.stub_close,
+    )
+    if args.serve is not None:
+        serveStub(args.serve, config)
+        exit(0)
+    if args.benchmark:
+        benchmark(
+            args.benchmark, config, args.concurrency, args.per_host, args.compressed
+        )
+        exit(0)
+    urllist = list(args.urls)
+    if not urllist and not args.sitemap:
         if sys.stdin.isatty():
             usage()
-    else:
-        urllist.extend(sys.argv[1:])
     if not sys.stdin.isatty():
         for line in sys.stdin:
             urllist.append(line)
-    main(urllist)
+    main(
+        urllist,
+        args.concurrency,
+        args.per_host,
+        args.compressed,
+        args.timing,
+        args.min_speedup,
+        args.sitemap,
+        args.warm_only,
+        args.rate,
+        args.soak,
+        args.interval,
+    )